@@ -1,17 +1,81 @@
 # -*- coding: utf-8 -*-
 
+import functools
+import os
 import time
 from os import chmod
 from pathlib import Path
-from shutil import copyfile
-from stat import S_IREAD, S_IRGRP, S_ISVTX, S_IXGRP, S_IXUSR
-from subprocess import check_output, Popen
+from stat import S_IREAD, S_IRGRP, S_ISDIR, S_ISVTX, S_IXGRP, S_IXUSR
 
 import click
-import toml
 
 from .about import __version__
 
+# Package data shipped alongside this module
+_CONFIG_DIR = Path(__file__).parent / "config"
+_GITIGNORE_PATH = _CONFIG_DIR / "gitignore"
+
+# Directories of a new project, and those kept on `linkto` (scratch) and
+# symlinked into it
+_PROJECT_DIRS = ("control", "notebooks", "bin", "src")
+_LINKED_DIRS = ("work", "data")
+
+# Modes set by `freeze`: read for user/group (plus traverse for directories),
+# and the sticky bit so only the owner can change them back
+_FREEZE_FILE_MODE = S_IREAD | S_IRGRP | S_ISVTX
+_FREEZE_DIR_MODE = _FREEZE_FILE_MODE | S_IXUSR | S_IXGRP
+
+# TOML and subprocess are imported where they are used so that `--help`,
+# `--version` and tab completion don't pay for them.
+def _toml_load(path):
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11
+        import tomli as tomllib
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def _toml_dump(config, f):
+    import tomli_w
+    tomli_w.dump(config, f)
+
+
+def _toml_dumps(config):
+    import tomli_w
+    return tomli_w.dumps(config)
+
+
+def _copy_small(src, dst):
+    """Copy a small file with a single read and write.
+
+    Skips `shutil.copyfile`'s same-file check and chunked copy loop, which
+    only pay off for large files.
+    """
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        d.write(s.read())
+
+
+def read_config(path, st=None):
+    """Return a private copy of the parsed makebio.toml at `path`.
+
+    `st` is the stat result of `path`, if the caller already has one.
+    """
+    import copy
+
+    if st is None:
+        st = os.stat(path)
+    return copy.deepcopy(_read_config(os.fspath(path), st.st_mtime_ns, st.st_size))
+
+
+@functools.lru_cache(maxsize=8)
+def _read_config(path, mtime_ns, size):
+    """Load the makebio.toml at `path`, memoized on its mtime and size.
+
+    The result is shared, callers must not mutate it.
+    """
+    return _toml_load(path)
+
 
 class Project(object):
     def __init__(self, path="."):
@@ -32,24 +96,54 @@ class Project(object):
                 "last_commit": ""
             },
         }
+        self._loaded = False
+        self._mtime = None
+        self._root = None
+
+        # Dates used for prefixes and commit messages, fixed for the lifetime
+        # of the object and rendered from a single localtime() lookup
+        now = time.localtime()
+        self.today = time.strftime("%Y-%m-%d", now)
+        self.now = time.strftime("%Y-%m-%d %H:%M", now)
 
     @property
     def config(self):
         config_p = Path(self._config["params"]["root"]) / "makebio.toml"
-        flag = False
-        if config_p.exists():
-            flag = True
-            self._config = toml.loads(open(config_p, "r").read())
-        return (self._config, flag)
+        try:
+            st = config_p.stat()
+        except FileNotFoundError:
+            return (self._config, False)
+
+        # Only re-parse if the file changed since we last read/wrote it
+        if not self._loaded or st.st_mtime_ns != self._mtime:
+            self._config = read_config(config_p, st)
+            self._loaded = True
+            self._mtime = st.st_mtime_ns
+        return (self._config, True)
 
     @config.setter
     def config(self, config):
         config_p = Path(self._config["params"]["root"]) / "makebio.toml"
-        with open(config_p, "w") as f:
-            toml.dump(config, f)
-            click.echo("info: wrote config to %s." % config_p)
+        # Write to a temp file and rename over, so an interrupted write
+        # never leaves a truncated makebio.toml behind
+        tmp = config_p.with_suffix(".toml.tmp")
+        with open(tmp, "wb") as f:
+            _toml_dump(config, f)
+        os.replace(tmp, config_p)
+        click.echo("info: wrote config to %s." % config_p)
+        self._config = config
+        self._loaded = True
+        self._mtime = config_p.stat().st_mtime_ns
+        self._root = None
         return True
 
+    @property
+    def root(self):
+        """Project root as recorded in makebio.toml."""
+        if self._root is None:
+            self._root = Path(self.config[0]["params"]["root"])
+        return self._root
+
 
 @click.group()
 @click.version_option(version=__version__)
@@ -97,7 +191,17 @@ def cli(ctx):
         exit(0)
 
 
+def _absolute(path, cwd):
+    """`str(path.absolute())` for a `cwd` the caller already looked up."""
+    if path.is_absolute():
+        return str(path)
+    # Path(".") renders as ".", which join() would keep as a trailing "/."
+    return cwd if str(path) == "." else os.path.join(cwd, path)
+
+
 def setup_config_and_dir(project, src, linkto, git):
+    from subprocess import DEVNULL, run
+
     config, config_found_flag = project.config
 
     if config_found_flag:
@@ -108,40 +212,60 @@ def setup_config_and_dir(project, src, linkto, git):
 
     # [params]
     config["name"] = src.name
-    config["params"]["root"] = str(src.absolute())
-    config["params"]["linkto"] = str(linkto.absolute())
+    # One getcwd() for both, recording the same strings as Path.absolute()
+    cwd = os.getcwd()
+    config["params"]["root"] = _absolute(src, cwd)
+    config["params"]["linkto"] = _absolute(linkto, cwd)
 
     # [configuration]
     config["configuration"]["init_git"] = git
 
     # [metadata]
     config["metadata"]["version"] = __version__
-    config["metadata"]["created_on"] = time.strftime("%Y-%m-%d")
+    config["metadata"]["created_on"] = project.today
     config["metadata"]["last_commit"] = "null"
 
-    (linkto / src.name / "work").mkdir(parents=True)
-    (linkto / src.name / "data").mkdir(parents=True)
+    # Nothing is written before all prompts are answered, so aborting one
+    # leaves no trace. `init` already refused existing roots; mkdir failing
+    # still catches one created while the prompts were up.
+    try:
+        src.mkdir(mode=0o744, parents=True)
+    except FileExistsError:
+        click.secho("fatal: %s already exists." % src, fg="red")
+        exit(0)
+
+    try:
+        (linkto / src.name).mkdir(parents=True)
+    except FileExistsError:
+        src.rmdir()
+        click.secho("fatal: %s already exists." % (linkto / src.name), fg="red")
+        exit(0)
 
-    src.mkdir(mode=0o744, parents=True)
+    # The leaves only need a bare mkdir(2) each. Absolute link targets, so
+    # the links also work when `linkto` was relative.
+    root = config["params"]["root"]
+    linked = os.path.join(config["params"]["linkto"], src.name)
+    for name in _PROJECT_DIRS:
+        os.mkdir(os.path.join(root, name))
+    for name in _LINKED_DIRS:
+        target = os.path.join(linked, name)
+        os.mkdir(target)
+        os.symlink(target, os.path.join(root, name), target_is_directory=True)
 
-    (src / "control").mkdir()
-    (src / "notebooks").mkdir()
-    (src / "bin").mkdir()
-    (src / "src").mkdir()
-    (src / "work").symlink_to(linkto / src.name / "work")
-    (src / "data").symlink_to(linkto / src.name / "data")
+    project.config = config
 
     if git:
         # Copy gitignore
-        copyfile(Path(__file__).parent / "config" / "gitignore", src / ".gitignore")
+        _copy_small(_GITIGNORE_PATH, src / ".gitignore")
         try:
-            check_output(f"git init {src}", shell=True)
+            # Argv lists with -C, no intermediate shell
+            for args in (["init", "-q"], ["add", "-A"],
+                         ["commit", "--allow-empty", "-q", "-m", "Initial"]):
+                run(["git", "-C", str(src)] + args, stdout=DEVNULL, check=True)
             click.secho("info: git init complete.", fg="yellow")
         except Exception:
             click.secho("error: failed to init git.", fg="red")
 
-    project.config = config
-
     click.secho("info: done.", fg="green")
     return config
 
@@ -159,14 +283,22 @@ def init(project, src, linkto, git):
     .gitignore is also supplied.
     """
     src, linkto = Path(src).expanduser(), Path(linkto).expanduser()
-    if src.exists():
-        click.secho("fatal: %s already exists." % src, fg="red")
-        exit(0)
+    linked = linkto / src.name
 
-    if (linkto / src.name).exists():
-        click.secho("fatal: %s already exists." % (linkto / src.name), fg="red")
+    # Refuse before asking anything
+    if os.path.realpath(src) == os.path.realpath(linked):
+        click.secho(
+            "fatal: %s would be its own scratch directory; choose a LINKTO "
+            "other than the project's parent." % src,
+            fg="red",
+        )
         exit(0)
 
+    for p in (src, linked):
+        if os.path.lexists(p):
+            click.secho("fatal: %s already exists." % p, fg="red")
+            exit(0)
+
     result = click.confirm("configure project?", default=True)
     if not result:
         click.secho("OK.")
@@ -186,15 +318,17 @@ def add_analysis(project, name, prefix):
     date as PREFIX (YY-MM-DD): PREFIX_NAME
     """
 
-    prefix = f"{time.strftime('%Y-%m-%d')}_" if prefix else ""
-    root = Path(project.config[0]["params"]["root"])
+    prefix = f"{project.today}_" if prefix else ""
+    root = os.fspath(project.root)
 
     try:
         dir_name = f"{prefix}{name}"
-        (root / "control" / dir_name).mkdir(parents=True)
-        (root / "work" / dir_name).mkdir(parents=True)
+        control_dir = os.path.join(root, "control", dir_name)
+        work_dir = os.path.join(root, "work", dir_name)
+        os.makedirs(control_dir)
+        os.makedirs(work_dir)
         # `target_is_directory` must be True for compatibility with Windows
-        (root / "control" / dir_name / "work").symlink_to(root / "work" / dir_name, target_is_directory=True)
+        os.symlink(work_dir, os.path.join(control_dir, "work"), target_is_directory=True)
 
         click.secho("success: created %s." % dir_name, fg="green")
     except FileExistsError as e:
@@ -209,12 +343,14 @@ def add_analysis(project, name, prefix):
 def show(project, all, latest):
     """Show current configuration."""
 
+    from subprocess import run
+
     if all:
-        print(toml.dumps(project.config[0]))
+        print(_toml_dumps(project.config[0]))
 
     if latest:
-        proc = Popen(["git", "log", "-1"], shell=False)
-        proc.communicate()
+        # Inherit our stdout/stderr so git writes straight to the terminal
+        run(["git", "log", "-1"], check=False)
 
     exit(0)
 
@@ -229,13 +365,15 @@ def update(project):
     update recorded value with last commit in the tree.
     """
 
+    from subprocess import check_output
+
     last_recorded_commit = project.config[0]["metadata"]["last_commit"]
 
     if last_recorded_commit == "null":
         click.secho("info: please run `makebio save` first.", fg="yellow")
         exit(0)
 
-    current_head = check_output("git rev-parse HEAD", shell=True, encoding="utf-8").strip()
+    current_head = check_output(["git", "rev-parse", "HEAD"], encoding="utf-8").strip()
 
     if current_head != last_recorded_commit:
         update_info, _ = project.config
@@ -256,15 +394,15 @@ def update(project):
 def rename_analysis(project, old, new, dry_run):
     """Rename existing analysis."""
 
-    root = Path(project.config[0]["params"]["root"])
+    root = project.root
     old_analysis_path = (root / "control" / old)
     new_analysis_path = (root / "control" / new)
 
-    if not old_analysis_path.exists():
+    if not os.path.exists(old_analysis_path):
         click.secho("fatal: analysis directory not found -- %s" % str(old), fg="red")
         exit(1)
 
-    if new_analysis_path.exists():
+    if os.path.lexists(new_analysis_path):
         click.secho("fatal: target anlaysis directory already exists", fg="red")
         exit(1)
 
@@ -299,22 +437,45 @@ def add_data(project, name, prefix):
     NEW directories will be created in control/ and data/ with the today's
     date as PREFIX (YY-MM-DD): PREFIX_NAME
     """
-    prefix = f"{time.strftime('%Y-%m-%d')}_" if prefix else ""
-    root = Path(project.config[0]["params"]["root"])
+    prefix = f"{project.today}_" if prefix else ""
+    root = os.fspath(project.root)
 
     try:
         dir_name = f"{prefix}{name}"
-        (root / "control" / dir_name).mkdir(parents=True)
-        (root / "data" / dir_name).mkdir(parents=True)
+        os.makedirs(os.path.join(root, "control", dir_name))
+        os.makedirs(os.path.join(root, "data", dir_name))
         click.secho("success: created %s." % dir_name, fg="green")
     except FileExistsError as e:
         click.secho("fatal: directories already exist -- %s" % str(e), fg="red")
         exit(1)
 
 
+def _chmod_tree(root, file_mode, dir_mode):
+    """Set `file_mode`/`dir_mode` on everything below directory `root`.
+
+    Walks iteratively with `os.scandir`, keeping one directory open at a
+    time, and leaves entries that already have the right mode untouched.
+    Symlinks are left alone so that frozen trees don't reach into
+    work/ or data/ on the scratch space.
+    """
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_symlink():
+                    continue
+                is_dir = entry.is_dir()
+                mode = dir_mode if is_dir else file_mode
+                # Skip the metadata write for entries frozen on an earlier run
+                if entry.stat(follow_symlinks=False).st_mode & 0o7777 != mode:
+                    chmod(entry.path, mode)
+                if is_dir:
+                    stack.append(entry.path)
+
+
 @cli.command()
 @click.argument("path", type=click.Path(exists=True))
-@click.argument("--recursive", required=False, default=False)
+@click.option("--recursive", is_flag=True)
 @click.pass_obj
 def freeze(project, path, recursive):
     """Mark a directory/file read only (for the user/group).
@@ -323,18 +484,33 @@ def freeze(project, path, recursive):
 
     --recursive will make all dirs/files within readonly.
     """
-    if Path(path).is_dir():
-        chmod(
-            path, S_IREAD | S_IRGRP | S_ISVTX | S_IXUSR | S_IXGRP
-        )  # Set read/execute bits
+    # One stat serves both the type check and the already-frozen check
+    mode = os.stat(path).st_mode
+    if S_ISDIR(mode):
+        if recursive:
+            _chmod_tree(path, _FREEZE_FILE_MODE, _FREEZE_DIR_MODE)
+        if mode & 0o7777 != _FREEZE_DIR_MODE:
+            chmod(path, _FREEZE_DIR_MODE)
         click.secho("success: directory marked read only.", fg="green")
     else:
-        chmod(path, S_IREAD | S_IRGRP | S_ISVTX)
+        if mode & 0o7777 != _FREEZE_FILE_MODE:
+            chmod(path, _FREEZE_FILE_MODE)
         click.secho("success: file marked read only.", fg="green")
 
     return path
 
 
+def _has_untracked(status):
+    """Whether `git status --porcelain -z` output lists untracked files."""
+    entries = iter(status.split(b"\0"))
+    for entry in entries:
+        if entry.startswith(b"??"):
+            return True
+        if b"R" in entry[:2] or b"C" in entry[:2]:
+            next(entries, None)  # skip the source path of a rename/copy
+    return False
+
+
 @cli.command()
 @click.argument("path", type=click.Path(exists=True), required=False)
 @click.pass_obj
@@ -345,31 +521,44 @@ def save(project, path):
     if you commit all the changes, just write a new commit to make new
     changes (including reverts).
     """
+
+    from subprocess import DEVNULL, CalledProcessError, check_output, run
+
     if path:
         project
+
+    # Every step is limited to the project directory (pathspec `.`), so
+    # changes elsewhere in an enclosing repository are left alone
+    status = ["git", "status", "--porcelain", "-z", "--untracked-files=normal", "--", "."]
     try:
-        check_if_git = check_output("git rev-parse --is-inside-work-tree", shell=True, encoding="utf-8").strip()
-        # Initialize git if not done before
-        if not check_if_git == "true":
-            check_output("git init", shell=True)
+        try:
+            # Fails outside of a work tree, so this doubles as the check for
+            # whether git needs to be initialized
+            changes = check_output(status, stderr=DEVNULL)
+        except CalledProcessError:
+            run(["git", "init", "-q"], stdout=DEVNULL, check=True)
             click.secho("info: initialized git")
+            changes = check_output(status)
 
-        check_untracked = check_output("git status -s", shell=True).strip().split()
-
-        if len(check_untracked) < 2:
+        if not changes:
             click.secho("tip: nothing to save?")
             return
 
-        current_date = time.strftime("%Y-%m-%d %H:%M")
-        check_output("git ls-files -z -dmo --exclude-standard | xargs -0 git add", shell=True)
-        check_output(f"git commit -m \"{current_date}\"", shell=True)
+        if _has_untracked(changes):
+            # Stages modified, deleted and untracked (non-ignored) files
+            # alike, so no `git ls-files` pipeline is needed
+            run(["git", "add", "-A", "."], stdout=DEVNULL, check=True)
+        # With a pathspec, commit picks up tracked changes below `.` itself,
+        # so the add above is only needed for untracked files
+        run(["git", "commit", "-q", "-m", project.now, "--", "."], stdout=DEVNULL, check=True)
         click.secho("success: files added and committed.", fg="green")
 
-        commit_id = check_output("git rev-parse HEAD", shell=True, encoding="utf-8").strip()
+        commit_id = check_output(["git", "rev-parse", "HEAD"], encoding="utf-8").strip()
 
         update_info, _ = project.config
-        update_info["metadata"].update({"last_commit": commit_id})
-        project.config = update_info
+        if update_info["metadata"]["last_commit"] != commit_id:
+            update_info["metadata"].update({"last_commit": commit_id})
+            project.config = update_info
     except Exception as e:
         click.secho("fatal: couldn't save -- %s" % str(e), fg="red")
         click.echo("tip: nothing to commit?")
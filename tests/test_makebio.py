@@ -1,5 +1,232 @@
+import os
+import shutil
+import stat
+import subprocess
+import time
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
 from makebio.about import __version__
+import makebio.cli
+from makebio.cli import (
+    _FREEZE_DIR_MODE,
+    _FREEZE_FILE_MODE,
+    Project,
+    _absolute,
+    _chmod_tree,
+    _has_untracked,
+    cli,
+    read_config,
+)
 
 
 def test_version():
     assert __version__ == "0.35"
+
+
+def _write_config(path, name, age):
+    """Write a minimal makebio.toml named `name`, last modified `age` s ago."""
+    path.write_text("name = \"%s\"\n\n[params]\nroot = '%s'\n" % (name, path.parent))
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def test_read_config_sees_edits(tmp_path):
+    config_p = tmp_path / "makebio.toml"
+
+    _write_config(config_p, "first", age=60)
+    assert read_config(config_p)["name"] == "first"
+
+    _write_config(config_p, "second!", age=30)
+    assert read_config(config_p)["name"] == "second!"
+
+
+def test_read_config_sees_same_size_edits(tmp_path):
+    config_p = tmp_path / "makebio.toml"
+
+    _write_config(config_p, "aaaa", age=60)
+    assert read_config(config_p)["name"] == "aaaa"
+
+    _write_config(config_p, "bbbb", age=30)
+    assert read_config(config_p)["name"] == "bbbb"
+
+
+def test_read_config_returns_a_copy(tmp_path):
+    config_p = tmp_path / "makebio.toml"
+
+    _write_config(config_p, "orig", age=60)
+    read_config(config_p)["name"] = "mutated"
+    assert read_config(config_p)["name"] == "orig"
+
+
+def test_project_config_reloads_after_edit(tmp_path):
+    config_p = tmp_path / "makebio.toml"
+    project = Project(tmp_path)
+
+    assert project.config == (project._config, False)
+
+    _write_config(config_p, "before", age=60)
+    assert project.config[0]["name"] == "before"
+
+    _write_config(config_p, "after!", age=30)
+    assert project.config[0]["name"] == "after!"
+
+
+def test_has_untracked():
+    assert _has_untracked(b"?? new\0")
+    assert _has_untracked(b" M file\0?? new\0")
+    assert not _has_untracked(b"")
+    assert not _has_untracked(b" M file\0D  gone\0")
+
+
+def test_has_untracked_skips_rename_and_copy_sources():
+    # The source path of a rename/copy follows as its own field and must
+    # not be read as a status entry, even if it happens to start with "??"
+    assert not _has_untracked(b"R  new\0?? weird-old-name\0")
+    assert not _has_untracked(b"C  copy\0?? weird-orig-name\0")
+    assert _has_untracked(b"R  new\0old\0?? other\0")
+
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path, follow_symlinks=False).st_mode)
+
+
+def _thaw(root):
+    """Give `root` back write permissions so tmp_path can be cleaned up."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        os.chmod(dirpath, 0o755)
+        for name in filenames:
+            if not os.path.islink(os.path.join(dirpath, name)):
+                os.chmod(os.path.join(dirpath, name), 0o644)
+
+
+def test_chmod_tree_freezes_and_skips_symlinks(tmp_path):
+    outside = tmp_path / "work"
+    outside.mkdir()
+    (outside / "scratch").write_text("")
+
+    root = tmp_path / "analysis"
+    (root / "sub").mkdir(parents=True)
+    (root / "sub" / "out.txt").write_text("")
+    (root / "work").symlink_to(outside)
+    (root / "scratch").symlink_to(outside / "scratch")
+
+    outside_modes = (_mode(outside), _mode(outside / "scratch"))
+    try:
+        _chmod_tree(str(root), _FREEZE_FILE_MODE, _FREEZE_DIR_MODE)
+        assert _mode(root / "sub") == _FREEZE_DIR_MODE
+        assert _mode(root / "sub" / "out.txt") == _FREEZE_FILE_MODE
+        assert (_mode(outside), _mode(outside / "scratch")) == outside_modes
+    finally:
+        _thaw(root)
+
+
+def test_chmod_tree_leaves_frozen_entries_alone(tmp_path, monkeypatch):
+    root = tmp_path / "analysis"
+    (root / "done").mkdir(parents=True)
+    (root / "done" / "out.txt").write_text("")
+    (root / "new.txt").write_text("")
+    os.chmod(root / "done" / "out.txt", _FREEZE_FILE_MODE)
+    os.chmod(root / "done", _FREEZE_DIR_MODE)
+
+    calls = []
+
+    def chmod(path, mode):
+        calls.append(path)
+        os.chmod(path, mode)
+
+    monkeypatch.setattr(makebio.cli, "chmod", chmod)
+    try:
+        _chmod_tree(str(root), _FREEZE_FILE_MODE, _FREEZE_DIR_MODE)
+        assert calls == [str(root / "new.txt")]
+    finally:
+        _thaw(root)
+
+
+
+needs_git = pytest.mark.skipif(shutil.which("git") is None, reason="git not installed")
+
+
+def _git(cwd, *args):
+    return subprocess.check_output(["git", "-C", str(cwd)] + list(args), encoding="utf-8")
+
+
+@pytest.fixture
+def nested_project(tmp_path, monkeypatch):
+    """A --no-git project in `proj/`, inside an enclosing repository."""
+    for var in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv("GIT_%s_NAME" % var, "makebio")
+        monkeypatch.setenv("GIT_%s_EMAIL" % var, "makebio@example.com")
+
+    proj = tmp_path / "proj"
+    (proj / "bin").mkdir(parents=True)
+    _write_config(proj / "makebio.toml", "proj", age=60)
+    (proj / "bin" / "run.sh").write_text("v1\n")
+    (tmp_path / "notes.txt").write_text("v1\n")
+    _git(tmp_path, "init", "-q")
+    _git(tmp_path, "add", "-A")
+    _git(tmp_path, "commit", "-q", "-m", "Initial")
+
+    monkeypatch.chdir(proj)
+    return proj
+
+
+def _save(proj):
+    result = CliRunner().invoke(cli, ["save"])
+    assert "success" in result.output, result.output
+    return _git(proj, "show", "--name-only", "--format=", "HEAD").split()
+
+
+@needs_git
+def test_save_commits_tracked_changes_in_project_only(nested_project):
+    (nested_project / "bin" / "run.sh").write_text("v2\n")
+    (nested_project.parent / "notes.txt").write_text("v2\n")
+
+    assert _save(nested_project) == ["proj/bin/run.sh"]
+    assert "notes.txt" in _git(nested_project, "status", "--porcelain")
+
+
+@needs_git
+def test_save_adds_untracked_files_in_project_only(nested_project):
+    (nested_project / "bin" / "new").write_text("")
+    (nested_project.parent / "notes.txt").write_text("v2\n")
+    (nested_project.parent / "other.txt").write_text("")
+
+    assert _save(nested_project) == ["proj/bin/new"]
+    status = _git(nested_project, "status", "--porcelain")
+    assert "notes.txt" in status and "other.txt" in status
+
+
+@needs_git
+def test_save_leaves_staged_changes_outside_project(nested_project):
+    (nested_project / "bin" / "new").write_text("")
+    _git(nested_project, "add", "bin/new")
+    (nested_project.parent / "notes.txt").write_text("v2\n")
+    _git(nested_project.parent, "add", "notes.txt")
+
+    assert _save(nested_project) == ["proj/bin/new"]
+    assert "M  notes.txt" in _git(nested_project, "status", "--porcelain")
+
+
+@pytest.mark.parametrize("existing", ["proj", "scratch/proj"])
+def test_init_refuses_existing_paths_before_prompting(tmp_path, monkeypatch, existing):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / existing).mkdir(parents=True)
+
+    result = CliRunner().invoke(cli, ["init", "proj", "scratch"], input="")
+    assert result.output == "fatal: %s already exists.\n" % existing
+
+
+def test_init_refuses_project_as_its_own_scratch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    result = CliRunner().invoke(cli, ["init", "proj", "."], input="")
+    assert result.output.startswith("fatal: proj would be its own scratch directory")
+    assert not (tmp_path / "proj").exists()
+
+
+@pytest.mark.parametrize("path", [".", "./proj", "proj/", "..", "a/b", "/abs/./b"])
+def test_absolute_matches_path_absolute(path):
+    assert _absolute(Path(path), os.getcwd()) == str(Path(path).absolute())